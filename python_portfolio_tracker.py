@@ -13,15 +13,58 @@ Description: A single-file portfolio tracker demonstrating
 import sqlite3
 import argparse
 import datetime
+import html
+import io
 import os
 import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from typing import Dict
 
+import numpy as np
 import pandas as pd
-import yfinance as yf
+import requests
+try:
+    # drop-in wrapper with an on-disk cache that invalidates on real
+    # market updates, so repeated runs don't re-fetch stable history
+    import yfinance_cache as yf
+except ImportError:
+    import yfinance as yf
+import matplotlib
+matplotlib.use('Agg')  # headless backend: no GUI event loop to initialize
 import matplotlib.pyplot as plt
+plt.rcParams['path.simplify'] = True
 from tabulate import tabulate
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+def _compute_metrics(shares, cost, price):
+    """Per-position metrics on contiguous float64 arrays; JIT-compiled
+    when numba is installed, plain NumPy ufuncs otherwise."""
+    current_value = shares * price
+    cost_basis = shares * cost
+    pnl_abs = current_value - cost_basis
+    pnl_pct = pnl_abs / cost_basis
+    return current_value, cost_basis, pnl_abs, pnl_pct
+
+if njit is not None:
+    # no fastmath: cost_basis can legitimately be 0 (free/granted shares)
+    # and the division must yield the same inf/nan as the NumPy path
+    compute_metrics = njit(cache=True)(_compute_metrics)
+    # warm-up call so the first real portfolio doesn't pay compile time
+    compute_metrics(np.ones(1), np.ones(1), np.ones(1))
+else:
+    compute_metrics = _compute_metrics
+
+# one pooled HTTP session for all yfinance calls: TCP/TLS setup is paid
+# once per server instead of once per ticker. Must stay a plain Session —
+# yfinance rejects caching sessions like requests_cache.CachedSession
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0'})
+
 DB_PATH = "portfolio.db"
 
 SCHEMA = '''
@@ -33,12 +76,28 @@ CREATE TABLE IF NOT EXISTS positions (
     trade_date TEXT NOT NULL,
     note TEXT
 );
+CREATE INDEX IF NOT EXISTS idx_positions_symbol ON positions(symbol);
+CREATE INDEX IF NOT EXISTS idx_positions_trade_date ON positions(trade_date);
+'''
+
+# one insert text shared by every write path, so SQLite reuses the same
+# prepared statement from its cache instead of re-parsing the SQL
+_INSERT_SQL = "INSERT INTO positions (symbol, shares, cost_per_share, trade_date, note) VALUES (?, ?, ?, ?, ?)"
+
+# WAL journaling + relaxed sync cut per-commit fsync cost while staying crash-safe
+PRAGMAS = '''
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=268435456;
 '''
 
 class PortfolioDB:
     def __init__(self, path=DB_PATH):
         self.path = path
-        self.conn = sqlite3.connect(self.path)
+        self.conn = sqlite3.connect(self.path, cached_statements=256)
+        self.conn.executescript(PRAGMAS)
         self._init_db()
 
     def _init_db(self):
@@ -48,54 +107,155 @@ class PortfolioDB:
 
     def add_position(self, symbol, shares, cost_per_share, trade_date, note=""):
         cur = self.conn.cursor()
-        cur.execute(
-            "INSERT INTO positions (symbol, shares, cost_per_share, trade_date, note) VALUES (?, ?, ?, ?, ?)",
-            (symbol.upper(), shares, cost_per_share, trade_date, note)
-        )
+        cur.execute(_INSERT_SQL, (symbol.upper(), shares, cost_per_share, trade_date, note))
         self.conn.commit()
 
+    def add_positions_bulk(self, rows):
+        """Insert many (symbol, shares, cost_per_share, trade_date, note) rows
+        inside a single transaction so SQLite fsyncs once, not per row."""
+        rows = [(sym.upper(), shares, cost, date, note)
+                for sym, shares, cost, date, note in rows]
+        with self.conn:
+            self.conn.executemany(_INSERT_SQL, rows)
+
     def list_positions(self):
         return pd.read_sql_query("SELECT * FROM positions", self.conn)
 
+    def aggregate_by_symbol(self):
+        """Per-symbol totals with the groupby pushed into SQLite, so only one
+        row per symbol crosses into pandas."""
+        return pd.read_sql_query(
+            """SELECT symbol,
+                      SUM(shares) AS shares,
+                      SUM(shares * cost_per_share) AS cost_basis
+               FROM positions
+               GROUP BY symbol
+               ORDER BY symbol""",
+            self.conn
+        )
+
     def delete_position(self, position_id):
         cur = self.conn.cursor()
         cur.execute("DELETE FROM positions WHERE id = ?", (position_id,))
         self.conn.commit()
 
+@dataclass
+class PortfolioState:
+    """Structure-of-arrays view of the positions table.
+
+    The numeric hot path works on parallel contiguous NumPy arrays with
+    symbols reduced to category codes; a DataFrame only reappears at the
+    presentation boundary (show_table, report HTML).
+    """
+    codes: np.ndarray        # int32 index into categories, one per row
+    categories: np.ndarray   # unique upper-cased symbols
+    shares: np.ndarray       # float64
+    cost: np.ndarray         # float64 cost per share
+
+    @classmethod
+    def from_frame(cls, df):
+        symbols = df['symbol']
+        if symbols.dtype != 'category':
+            symbols = symbols.astype(str).str.upper().astype('category')
+        return cls(
+            codes=symbols.cat.codes.to_numpy(dtype=np.int32),
+            categories=symbols.cat.categories.to_numpy(dtype=object),
+            shares=df['shares'].to_numpy(dtype=np.float64),
+            cost=df['cost_per_share'].to_numpy(dtype=np.float64),
+        )
+
+
 class PortfolioAnalyzer:
     def __init__(self, df_positions):
-        self.positions = df_positions.copy()
+        # hold a reference; only copy if we actually need to rewrite symbols.
+        # category dtype keeps groupby/merge on integer codes instead of strings
+        self.positions = df_positions
+        self.state = None
         if not self.positions.empty:
-            self.positions['symbol'] = self.positions['symbol'].str.upper()
+            symbols = self.positions['symbol']
+            if symbols.dtype != 'category' or not symbols.cat.categories.str.isupper().all():
+                self.positions = self.positions.copy()
+                self.positions['symbol'] = symbols.astype(str).str.upper().astype('category')
+            self.state = PortfolioState.from_frame(self.positions)
+
+    BATCH_SIZE = 20  # Yahoo's chart endpoint handles ~20 tickers per request
 
     def fetch_prices(self):
         if self.positions.empty:
             return pd.DataFrame(columns=['symbol','current_price'])
-        symbols = self.positions['symbol'].unique().tolist()
-        data = {}
-        for sym in symbols:
+        symbols = self.state.categories.tolist()
+        data = {sym: 0.0 for sym in symbols}
+        missing = []
+        # One multi-symbol download per chunk instead of one HTTP request per ticker
+        for i in range(0, len(symbols), self.BATCH_SIZE):
+            chunk = symbols[i:i + self.BATCH_SIZE]
             try:
-                t = yf.Ticker(sym)
-                hist = t.history(period='5d')
-                price = hist['Close'].iloc[-1] if not hist.empty else 0.0
-                data[sym] = price
+                hist = yf.download(tickers=" ".join(chunk), period='5d',
+                                   progress=False, threads=True, group_by='ticker',
+                                   session=SESSION)
+                if hist.empty:
+                    missing.extend(chunk)
+                    continue
+                if len(chunk) == 1:
+                    # single-ticker downloads may come back flat or still
+                    # keyed by (ticker, field) depending on yfinance version
+                    if isinstance(hist.columns, pd.MultiIndex):
+                        closes = hist[chunk[0]]['Close'].ffill()
+                    else:
+                        closes = hist['Close'].ffill()
+                    if not closes.dropna().empty:
+                        data[chunk[0]] = float(closes.iloc[-1])
+                    else:
+                        missing.append(chunk[0])
+                else:
+                    closes = hist.xs('Close', level=1, axis=1).ffill().iloc[-1]
+                    for sym in chunk:
+                        if sym in closes.index and pd.notna(closes[sym]):
+                            data[sym] = float(closes[sym])
+                        else:
+                            missing.append(sym)
             except Exception as e:
-                print(f"Warning: could not fetch {sym}: {e}")
-                data[sym] = 0.0
+                print(f"Warning: could not fetch {chunk}: {e}")
+                missing.extend(chunk)
+        # Retry stragglers one at a time, but in parallel threads
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(32, len(missing))) as pool:
+                futures = {pool.submit(self._fetch_one, sym): sym for sym in missing}
+                for fut in as_completed(futures):
+                    sym, price = fut.result()
+                    data[sym] = price
         return pd.DataFrame(list(data.items()), columns=['symbol', 'current_price'])
 
+    @staticmethod
+    def _fetch_one(sym):
+        try:
+            hist = yf.Ticker(sym, session=SESSION).history(period='5d')
+            return sym, float(hist['Close'].iloc[-1]) if not hist.empty else 0.0
+        except Exception as e:
+            print(f"Warning: could not fetch {sym}: {e}")
+            return sym, 0.0
+
     def summary(self):
         if self.positions.empty:
             return {}
         prices = self.fetch_prices()
-        df = self.positions.merge(prices, on='symbol', how='left')
-        df['current_value'] = df['shares'] * df['current_price']
-        df['cost_basis'] = df['shares'] * df['cost_per_share']
-        df['pnl_abs'] = df['current_value'] - df['cost_basis']
-        df['pnl_pct'] = df['pnl_abs'] / df['cost_basis']
-        total_value = df['current_value'].sum()
-        total_cost = df['cost_basis'].sum()
+        state = self.state
+        # per-symbol prices -> per-row array via the category codes: the
+        # whole hot path runs on the SoA arrays, no merge and no groupby
+        price_per_symbol = (prices.set_index('symbol')['current_price']
+                                  .reindex(state.categories).fillna(0.0)
+                                  .to_numpy(dtype=np.float64))
+        current_price = price_per_symbol[state.codes]
+        current_value, cost_basis, pnl_abs, pnl_pct = compute_metrics(
+            state.shares, state.cost, current_price)
+        total_value = float(current_value.sum())
+        total_cost = float(cost_basis.sum())
         total_pnl = total_value - total_cost
+        # DataFrame only at the presentation boundary
+        df = self.positions.assign(current_price=current_price,
+                                   current_value=current_value,
+                                   cost_basis=cost_basis,
+                                   pnl_abs=pnl_abs, pnl_pct=pnl_pct)
         return {'positions': df, 'total_value': total_value, 'total_cost': total_cost, 'total_pnl': total_pnl}
 
     def show_table(self, df_table):
@@ -115,42 +275,50 @@ class PortfolioAnalyzer:
             return
         df = s['positions'].copy()
 
-        # --- Create allocation pie chart ---
-        fig1, ax1 = plt.subplots(figsize=(6,6))
+        # --- Create allocation pie + P&L bar in one figure, one render pass ---
+        fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14,6))
         labels = df['symbol']
         sizes = df['current_value']
         if sizes.sum() == 0:
-            sizes = [1 for _ in sizes]
+            sizes = np.ones_like(sizes.to_numpy())
         ax1.pie(sizes, labels=labels, autopct='%1.1f%%')
         ax1.set_title('Portfolio Allocation')
-        pie_path = os.path.join(out_folder, 'allocation.png')
-        fig1.savefig(pie_path, bbox_inches='tight')
-        plt.close(fig1)
-
-        # --- Create P&L bar chart ---
-        fig2, ax2 = plt.subplots(figsize=(8,4))
         ax2.bar(df['symbol'], df['pnl_abs'])
         ax2.set_ylabel('P&L (abs)')
         ax2.set_title('Position P&L')
-        bar_path = os.path.join(out_folder, 'pnl.png')
-        fig2.savefig(bar_path, bbox_inches='tight')
-        plt.close(fig2)
+        # render straight into memory; the PNG only ever lives inside the HTML
+        png_buf = io.BytesIO()
+        fig.savefig(png_buf, format='png', dpi=90, bbox_inches='tight')
+        plt.close(fig)
+        charts_b64 = base64.b64encode(png_buf.getvalue()).decode('ascii')
 
-        # --- Create HTML with embedded images and table ---
+        # --- Assemble HTML in memory, flush with a single write ---
         html_path = os.path.join(out_folder, 'report.html')
-        table_html = df[['symbol','shares','current_price','cost_basis','current_value','pnl_abs']].round(2).to_html(index=False)
+        table_cols = ['symbol', 'shares', 'current_price', 'cost_basis', 'current_value', 'pnl_abs']
+        rows = zip(df['symbol'].to_numpy(),
+                   *(df[c].to_numpy().round(2) for c in table_cols[1:]))
+
+        buf = io.StringIO()
+        buf.write('<html><head><meta charset="utf-8"><title>Portfolio Report</title></head><body>')
+        buf.write(f"<h1>Portfolio Report - {datetime.date.today().isoformat()}</h1>")
+        buf.write(f"<p><strong>Total value:</strong> {s['total_value']:.2f} &nbsp;&nbsp; <strong>Total cost:</strong> {s['total_cost']:.2f} &nbsp;&nbsp; <strong>Total P&L:</strong> {s['total_pnl']:.2f}</p>")
+        buf.write('<h2>Allocation &amp; Position P&L</h2>')
+        buf.write(f'<img src="data:image/png;base64,{charts_b64}" alt="charts" style="max-width:1400px;width:100%;"><br>')
+        buf.write('<h2>Positions</h2>')
+        buf.write('<table border="1"><thead><tr>')
+        buf.write(''.join(f'<th>{html.escape(c)}</th>' for c in table_cols))
+        buf.write('</tr></thead><tbody>')
+        # hand-rolled rows skip pandas' to_html/styler machinery; escape
+        # cell values since symbols/notes are free-form user input
+        buf.write(''.join(
+            '<tr><td>' + '</td><td>'.join(html.escape(str(v)) for v in row) + '</td></tr>'
+            for row in rows
+        ))
+        buf.write('</tbody></table>')
+        buf.write('</body></html>')
 
         with open(html_path, 'w', encoding='utf-8') as f:
-            f.write('<html><head><meta charset="utf-8"><title>Portfolio Report</title></head><body>')
-            f.write(f"<h1>Portfolio Report - {datetime.date.today().isoformat()}</h1>")
-            f.write(f"<p><strong>Total value:</strong> {s['total_value']:.2f} &nbsp;&nbsp; <strong>Total cost:</strong> {s['total_cost']:.2f} &nbsp;&nbsp; <strong>Total P&L:</strong> {s['total_pnl']:.2f}</p>")
-            f.write('<h2>Allocation</h2>')
-            f.write(f'<img src="{os.path.basename(pie_path)}" alt="allocation" style="max-width:700px;"><br>')
-            f.write('<h2>Position P&L</h2>')
-            f.write(f'<img src="{os.path.basename(bar_path)}" alt="pnl" style="max-width:700px;"><br>')
-            f.write('<h2>Positions</h2>')
-            f.write(table_html)
-            f.write('</body></html>')
+            f.write(buf.getvalue())
 
         print(f"Report generated: {html_path}")
 
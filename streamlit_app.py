@@ -1,12 +1,40 @@
 # streamlit_app.py
 import streamlit as st
+import numpy as np
 import pandas as pd
-import yfinance as yf
+try:
+    # drop-in wrapper with an on-disk cache that invalidates on real
+    # market updates, so long sessions don't re-fetch stable history
+    import yfinance_cache as yf
+    _YF_CACHE = True
+except ImportError:
+    import yfinance as yf
+    _YF_CACHE = False
 import datetime
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import create_engine, event
 import matplotlib.pyplot as plt
+import asyncio
+import io
 import os
 import sqlite3
+import requests
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
 
 DB_PATH = "portfolio.db"
 st.set_page_config(page_title="Portfolio Tracker", layout="wide")
@@ -14,9 +42,27 @@ st.set_page_config(page_title="Portfolio Tracker", layout="wide")
 # -------------------------
 # DB helpers
 # -------------------------
+# WAL journaling + relaxed sync cut per-commit fsync cost while staying crash-safe
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+)
+
 @st.cache_resource
 def get_engine(path=DB_PATH):
-    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        for pragma in PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
 
 from sqlalchemy import text
 
@@ -33,39 +79,185 @@ def init_db():
         note TEXT
     );
     """)
+    index_sqls = (
+        text("CREATE INDEX IF NOT EXISTS idx_positions_symbol ON positions(symbol);"),
+        text("CREATE INDEX IF NOT EXISTS idx_positions_trade_date ON positions(trade_date);"),
+    )
     with engine.begin() as conn:
         conn.execute(create_sql)
+        for index_sql in index_sqls:
+            conn.execute(index_sql)
     return engine
 
 
-def read_positions_df():
+@st.cache_resource
+def get_duckdb():
+    if duckdb is None:
+        return None
+    try:
+        con = duckdb.connect()
+        con.execute("INSTALL sqlite; LOAD sqlite;")
+        return con
+    except Exception:
+        return None
+
+
+def aggregate_by_symbol(df, prices, path=DB_PATH):
+    """Per-symbol totals joined with current prices.
+
+    When DuckDB is available the scan, groupby and price join all run in
+    its vectorized engine straight off the SQLite file; otherwise fall
+    back to the pandas groupby over the already-loaded frame.
+    """
+    con = get_duckdb()
+    if con is not None:
+        try:
+            price_df = pd.DataFrame(
+                {"symbol": list(prices.keys()), "current_price": list(prices.values())}
+            )
+            return con.execute(
+                """
+                SELECT upper(p.symbol) AS symbol,
+                       SUM(p.shares) AS shares,
+                       SUM(p.shares * p.cost_per_share) AS cost_basis,
+                       SUM(p.shares) * COALESCE(any_value(q.current_price), 0.0) AS current_value,
+                       SUM(p.shares) * COALESCE(any_value(q.current_price), 0.0)
+                           - SUM(p.shares * p.cost_per_share) AS pnl_abs
+                FROM sqlite_scan(?, 'positions') p
+                LEFT JOIN price_df q ON upper(p.symbol) = q.symbol
+                GROUP BY upper(p.symbol)
+                ORDER BY symbol
+                """,
+                [path],
+            ).df()
+        except Exception:
+            pass  # e.g. sqlite extension unavailable offline; use pandas
+    agg = df.groupby('symbol', observed=True).agg({
+        'shares': 'sum',
+        'cost_basis': 'sum',
+        'current_value': 'sum',
+        'pnl_abs': 'sum'
+    }).reset_index()
+    return agg
+
+
+@st.cache_data
+def _read_positions_cached(mtime):
     engine = get_engine()
     df = pd.read_sql("SELECT * FROM positions", engine)
     if not df.empty:
-        df['symbol'] = df['symbol'].str.upper()
+        # category dtype: groupby/map work on integer codes, not Python strings
+        df['symbol'] = df['symbol'].str.upper().astype('category')
     return df
 
+
+def read_positions_df():
+    # key the cache on the DB file mtime (WAL included) so the table is read
+    # once per rerun even when several branches ask for it, and writes from
+    # add_trade / import_csv_to_db invalidate it implicitly
+    mtime = 0.0
+    for path in (DB_PATH, DB_PATH + "-wal"):
+        try:
+            mtime = max(mtime, os.path.getmtime(path))
+        except OSError:
+            pass
+    return _read_positions_cached(mtime)
+
 # -------------------------
 # Price fetching
 # -------------------------
-@st.cache_data(ttl=60)
+@st.cache_resource
+def get_session():
+    """One pooled HTTP session for all yfinance calls, so TCP/TLS setup
+    is paid once per server instead of once per ticker. Must be a plain
+    Session: yfinance rejects caching sessions like requests_cache."""
+    s = requests.Session()
+    s.headers.update({'User-Agent': 'Mozilla/5.0'})
+    return s
+
+
+BATCH_SIZE = 20  # Yahoo's chart endpoint handles ~20 tickers per request
+
+QUOTE_URL = "https://query1.finance.yahoo.com/v7/finance/quote"
+
+def _fetch_prices_async(symbols):
+    """All quote chunks in flight at once on a single event loop — no
+    thread pool cap and no per-task GIL handoff."""
+    chunks = [symbols[i:i + BATCH_SIZE] for i in range(0, len(symbols), BATCH_SIZE)]
+
+    async def fetch_all():
+        async with aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'}) as session:
+            async def fetch_chunk(chunk):
+                async with session.get(QUOTE_URL, params={"symbols": ",".join(chunk)}) as resp:
+                    resp.raise_for_status()
+                    return await resp.json()
+            return await asyncio.gather(*(fetch_chunk(c) for c in chunks))
+
+    prices = {s: 0.0 for s in symbols}
+    for payload in asyncio.run(fetch_all()):
+        for quote in payload.get("quoteResponse", {}).get("result", []):
+            price = quote.get("regularMarketPrice")
+            if price is not None:
+                prices[quote["symbol"]] = float(price)
+    return prices
+
+# with the disk cache the wrapper invalidates on real price changes, so the
+# in-memory TTL can be much longer than the bare 60s rate-limit guard
+@st.cache_data(ttl=600 if _YF_CACHE else 60)
 def fetch_current_prices(symbols):
-    prices = {}
-    for s in symbols:
+    symbols = list(symbols)
+    if aiohttp is not None:
         try:
-            t = yf.Ticker(s)
-            hist = t.history(period="5d")
-            if not hist.empty:
-                prices[s] = float(hist['Close'].iloc[-1])
+            return _fetch_prices_async(symbols)
+        except Exception:
+            pass  # endpoint hiccup: fall back to the yfinance batch path
+    prices = {s: 0.0 for s in symbols}
+    missing = []
+    # one multi-symbol download per chunk instead of one request per ticker
+    for i in range(0, len(symbols), BATCH_SIZE):
+        chunk = list(symbols[i:i + BATCH_SIZE])
+        try:
+            hist = yf.download(tickers=" ".join(chunk), period="5d",
+                               progress=False, threads=True, group_by='ticker',
+                               session=get_session())
+            if hist.empty:
+                missing.extend(chunk)
+                continue
+            if len(chunk) == 1:
+                # single-ticker downloads may come back flat or still keyed
+                # by (ticker, field) depending on yfinance version
+                if isinstance(hist.columns, pd.MultiIndex):
+                    closes = hist[chunk[0]]['Close'].ffill()
+                else:
+                    closes = hist['Close'].ffill()
+                if closes.dropna().empty:
+                    missing.append(chunk[0])
+                else:
+                    prices[chunk[0]] = float(closes.iloc[-1])
             else:
-                info_price = None
-                try:
-                    info_price = t.info.get('regularMarketPrice')
-                except Exception:
-                    info_price = None
-                prices[s] = float(info_price) if info_price is not None else 0.0
+                closes = hist.xs('Close', level=1, axis=1).ffill().iloc[-1]
+                for s in chunk:
+                    if s in closes.index and pd.notna(closes[s]):
+                        prices[s] = float(closes[s])
+                    else:
+                        missing.append(s)
+        except Exception:
+            missing.extend(chunk)
+    # fall back to the quote endpoint for anything the batch missed,
+    # fanned out over threads so wall time is max(latency), not sum(latency)
+    def _fetch_one(sym):
+        try:
+            info_price = yf.Ticker(sym, session=get_session()).info.get('regularMarketPrice')
+            return sym, float(info_price) if info_price is not None else 0.0
         except Exception:
-            prices[s] = 0.0
+            return sym, 0.0
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(32, len(missing))) as pool:
+            futures = {pool.submit(_fetch_one, s): s for s in missing}
+            for fut in as_completed(futures):
+                sym, price = fut.result()
+                prices[sym] = price
     return prices
 
 # -------------------------
@@ -73,13 +265,21 @@ def fetch_current_prices(symbols):
 # -------------------------
 from sqlalchemy import text   # add this at top of file if not already present
 
+# module-level text() constructs: SQLAlchemy's compiled cache is keyed on the
+# statement object, so reusing one instance skips re-compiling per insert
+INSERT_TRADE_SQL = text("""
+    INSERT INTO positions (symbol, shares, cost_per_share, trade_date, note)
+    VALUES (:symbol, :shares, :price, :date, :note)
+""")
+
+INSERT_ROW_SQL = text("""
+    INSERT INTO positions (symbol, shares, cost_per_share, trade_date, note)
+    VALUES (:symbol, :shares, :cost_per_share, :trade_date, :note)
+""")
+
 def add_trade(symbol, shares, price, date, note=""):
     engine = get_engine()
     symbol = symbol.upper()
-    insert_sql = text("""
-        INSERT INTO positions (symbol, shares, cost_per_share, trade_date, note)
-        VALUES (:symbol, :shares, :price, :date, :note)
-    """)
     params = {
         "symbol": symbol,
         "shares": float(shares),
@@ -88,14 +288,21 @@ def add_trade(symbol, shares, price, date, note=""):
         "note": note or ""
     }
     with engine.begin() as conn:
-        conn.execute(insert_sql, params)
+        conn.execute(INSERT_TRADE_SQL, params)
 
 
 def import_csv_to_db(uploaded_file):
     df = pd.read_csv(uploaded_file)
     df = df.rename(columns=lambda c: c.strip())
+    if "note" not in df.columns:
+        df["note"] = ""
     engine = get_engine()
-    df.to_sql("positions", engine, if_exists="append", index=False)
+    rows = df[["symbol", "shares", "cost_per_share", "trade_date", "note"]].to_dict("records")
+    if not rows:
+        return  # headers-only CSV: nothing to insert
+    # one transaction + executemany instead of pandas' per-row inserts
+    with engine.begin() as conn:
+        conn.execute(INSERT_ROW_SQL, rows)
 
 # -------------------------
 # UI: Sidebar
@@ -137,11 +344,16 @@ if st.sidebar.button("Generate HTML report (report/report.html)"):
         st.sidebar.warning("No positions to report")
     else:
         prices = fetch_current_prices(df['symbol'].unique().tolist())
-        pos = df.copy()
-        pos['current_price'] = pos['symbol'].map(prices)
-        pos['current_value'] = pos['shares'] * pos['current_price']
-        pos['cost_basis'] = pos['shares'] * pos['cost_per_share']
-        pos['pnl_abs'] = pos['current_value'] - pos['cost_basis']
+        # df is a fresh read, so mutate it in place instead of copying
+        pos = df
+        # mapping a categorical can itself return category dtype; the
+        # arithmetic below needs a plain float column
+        pos['current_price'] = pos['symbol'].map(prices).astype('float64')
+        pos = pos.eval(
+            "current_value = shares * current_price\n"
+            "cost_basis = shares * cost_per_share\n"
+            "pnl_abs = current_value - cost_basis"
+        )
         out_folder = "report"
         os.makedirs(out_folder, exist_ok=True)
         html_path = os.path.join(out_folder, "report.html")
@@ -166,25 +378,34 @@ if df.empty:
 # Fetch prices and compute metrics
 symbols = df['symbol'].unique().tolist()
 prices = fetch_current_prices(symbols)
-df['current_price'] = df['symbol'].map(prices)
-df['current_value'] = df['shares'] * df['current_price']
-df['cost_basis'] = df['shares'] * df['cost_per_share']
-df['pnl_abs'] = df['current_value'] - df['cost_basis']
-df['pnl_pct'] = (df['pnl_abs'] / df['cost_basis']).fillna(0)
-
-# Aggregated per symbol
-agg = df.groupby('symbol').agg({
-    'shares':'sum',
-    'cost_basis':'sum',
-    'current_value':'sum',
-    'pnl_abs':'sum'
-}).reset_index()
+# .astype: mapping a categorical can return category dtype, which eval rejects
+df['current_price'] = df['symbol'].map(pd.Series(prices)).astype('float64')
+df = df.eval(
+    "current_value = shares * current_price\n"
+    "cost_basis = shares * cost_per_share\n"
+    "pnl_abs = current_value - cost_basis\n"
+    "pnl_pct = pnl_abs / cost_basis"
+)
+df['pnl_pct'] = df['pnl_pct'].fillna(0)
+
+# Aggregated per symbol (DuckDB over the SQLite file when available)
+agg = aggregate_by_symbol(df, prices)
 agg['pnl_pct'] = (agg['pnl_abs'] / agg['cost_basis']).fillna(0)
 total_value = agg['current_value'].sum()
 total_cost = agg['cost_basis'].sum()
 total_pnl = total_value - total_cost
 agg['allocation_pct'] = agg['current_value'] / (total_value if total_value else 1)
 
+# arithmetic stays float64 above; quantize to float32 at the display
+# boundary — plenty of precision for dollars/percents, half the bytes
+# shipped to matplotlib and Streamlit's Arrow serializer (and the CSV)
+agg = agg.astype({c: 'float32' for c in
+                  ('shares', 'cost_basis', 'current_value', 'pnl_abs',
+                   'pnl_pct', 'allocation_pct')})
+df = df.astype({c: 'float32' for c in
+                ('shares', 'cost_per_share', 'current_price',
+                 'current_value', 'cost_basis', 'pnl_abs', 'pnl_pct')})
+
 # KPI row
 col1, col2, col3, col4 = st.columns(4)
 col1.metric("Total market value", f"${total_value:,.2f}")
@@ -201,9 +422,9 @@ with left:
     st.subheader("Allocation")
     fig1, ax1 = plt.subplots(figsize=(5,5))
     labels = agg['symbol'].tolist()
-    sizes = agg['current_value'].tolist()
-    if sum(sizes) == 0:
-        sizes = [1 for _ in sizes]
+    sizes = agg['current_value'].to_numpy()
+    if sizes.sum() == 0:
+        sizes = np.ones_like(sizes)
     explode = [0.03]*len(labels)
     ax1.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, explode=explode)
     ax1.set_title('Portfolio Allocation')
@@ -214,7 +435,7 @@ with left:
 with right:
     st.subheader("Position P&L (abs)")
     fig2, ax2 = plt.subplots(figsize=(6,4))
-    colors = ['#2ca02c' if v>=0 else '#d62728' for v in agg['pnl_abs']]
+    colors = np.where(agg['pnl_abs'].to_numpy() >= 0, '#2ca02c', '#d62728')
     ax2.bar(agg['symbol'], agg['pnl_abs'], color=colors)
     ax2.set_ylabel('P&L (abs)')
     ax2.set_title('Position P&L')
@@ -222,19 +443,48 @@ with right:
     plt.close(fig2)
 
 st.markdown("---")
+# column_config formatting happens in the Arrow frontend; the pandas
+# Styler would materialize per-cell HTML in Python on every rerun
+_DOLLARS = st.column_config.NumberColumn(format="$%.2f")
+_PERCENT = st.column_config.NumberColumn(format="percent")
+
 st.subheader("Positions")
-st.dataframe(agg[['symbol','shares','current_value','cost_basis','pnl_abs','pnl_pct','allocation_pct']].sort_values('current_value', ascending=False).style.format({
-    'current_value':'${:,.2f}', 'cost_basis':'${:,.2f}', 'pnl_abs':'${:,.2f}', 'pnl_pct':'{:.2%}', 'allocation_pct':'{:.2%}'
-}), height=300)
+st.dataframe(
+    agg[['symbol','shares','current_value','cost_basis','pnl_abs','pnl_pct','allocation_pct']].sort_values('current_value', ascending=False),
+    column_config={
+        'current_value': _DOLLARS, 'cost_basis': _DOLLARS, 'pnl_abs': _DOLLARS,
+        'pnl_pct': _PERCENT, 'allocation_pct': _PERCENT,
+    },
+    height=300,
+)
 
 st.subheader("All Trades (raw)")
-st.dataframe(df.sort_values('trade_date', ascending=False).style.format({
-    'current_price':'${:,.2f}', 'cost_per_share':'${:,.2f}', 'current_value':'${:,.2f}', 'cost_basis':'${:,.2f}', 'pnl_abs':'${:,.2f}', 'pnl_pct':'{:.2%}'
-}), height=240)
-
-# CSV download
-@st.cache_data
+st.dataframe(
+    df.sort_values('trade_date', ascending=False),
+    column_config={
+        'current_price': _DOLLARS, 'cost_per_share': _DOLLARS,
+        'current_value': _DOLLARS, 'cost_basis': _DOLLARS,
+        'pnl_abs': _DOLLARS, 'pnl_pct': _PERCENT,
+    },
+    height=240,
+)
+
+# CSV download. Rows are append-only, so (row count, max id) identifies the
+# table state, and the current_price sum captures the enriched price columns
+# — a cache key that avoids hashing the whole frame by value.
+@st.cache_data(hash_funcs={pd.DataFrame: lambda d: (
+    len(d),
+    int(d['id'].max()) if len(d) else 0,
+    float(d['current_price'].sum()) if 'current_price' in d.columns else 0.0,
+)})
 def df_to_csv_bytes(df_):
+    if pa is not None:
+        try:
+            buf = io.BytesIO()
+            pacsv.write_csv(pa.Table.from_pandas(df_, preserve_index=False), buf)
+            return buf.getvalue()
+        except Exception:
+            pass
     return df_.to_csv(index=False).encode('utf-8')
 
 st.download_button("Download positions CSV", data=df_to_csv_bytes(df), file_name="positions_export.csv", mime="text/csv")